@@ -0,0 +1,81 @@
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+BACKUP_DIR = 'backups'
+# 保留的快照数量
+BACKUP_KEEP = 5
+# 每步复制的页数；每步之间短暂让出连接，界面线程的查询最多等待一步
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_PAUSE = 0.002
+
+# 快照目录中每个库对应的文件名
+SNAPSHOT_FILES = (('main', 'todo.db'), ('archive', 'archive.db'))
+
+
+def backup_database(conn, path, name='main', pages=BACKUP_PAGES_PER_STEP, progress=None):
+    def step(status, remaining, total):
+        if progress:
+            progress(name, remaining, total)
+        time.sleep(BACKUP_STEP_PAUSE)
+
+    target = sqlite3.connect(path)
+    try:
+        conn.backup(target, pages=pages, progress=step, name=name)
+    finally:
+        target.close()
+
+
+def list_snapshots(backup_dir=BACKUP_DIR):
+    # 按时间从新到旧返回快照目录，未完成的 .part 目录不算
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [name for name in os.listdir(backup_dir)
+             if not name.endswith('.part') and os.path.isdir(os.path.join(backup_dir, name))]
+    return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+
+def rotate_snapshots(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    for snapshot in list_snapshots(backup_dir)[keep:]:
+        shutil.rmtree(snapshot, ignore_errors=True)
+
+
+def create_snapshot(conn, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP, progress=None):
+    name = datetime.now().strftime('%Y%m%d-%H%M%S')
+    snapshot = os.path.join(backup_dir, name)
+    suffix = 1
+    while os.path.exists(snapshot):
+        snapshot = os.path.join(backup_dir, f'{name}-{suffix}')
+        suffix += 1
+
+    # 先写入临时目录，全部完成后再改名，避免留下不完整的快照
+    partial = snapshot + '.part'
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    try:
+        for schema, filename in SNAPSHOT_FILES:
+            backup_database(conn, os.path.join(partial, filename), schema, progress=progress)
+    except Exception:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    os.replace(partial, snapshot)
+    rotate_snapshots(backup_dir, keep)
+    return snapshot
+
+
+def restore_snapshot(conn, snapshot, archive_path='archive.db'):
+    # backup API 只能写入目标连接的 main 库，归档库通过单独的连接恢复
+    for schema, filename in SNAPSHOT_FILES:
+        path = os.path.join(snapshot, filename)
+        if not os.path.exists(path):
+            continue
+        source = sqlite3.connect(path)
+        target = conn if schema == 'main' else sqlite3.connect(archive_path)
+        try:
+            source.backup(target, pages=BACKUP_PAGES_PER_STEP)
+        finally:
+            source.close()
+            if target is not conn:
+                target.close()
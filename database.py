@@ -1,15 +1,332 @@
+import os
 import sqlite3
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
+from tag_index import TagIndex, iter_bits
+from backup import (BACKUP_PAGES_PER_STEP, backup_database, create_snapshot, list_snapshots,
+                    restore_snapshot)
+
+
+def archive_path_for(path):
+    # 默认的 todo.db 对应 archive.db，其他数据库文件使用 <名称>-archive.db
+    if path == ':memory:':
+        return path
+    directory, filename = os.path.split(path)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'archive.db' if stem == 'todo' else f'{stem}-archive.db')
+
+
+def backup_dir_for(path):
+    # 每个数据库文件使用自己的备份目录，避免轮换或恢复时混用其他数据库的快照
+    directory, filename = os.path.split(path)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'backups' if stem == 'todo' or path == ':memory:' else f'{stem}-backups')
+
 
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect('todo.db')
+    # 在原始表结构之后追加的列，按顺序迁移到已有数据库
+    EXTRA_COLUMNS = [
+        ('recurrence', 'TEXT'),  # 重复规则，见 recurrence.py
+        ('recurrence_parent_id', 'INTEGER'),  # 落库的发生记录所属的重复任务
+        ('occurrence_date', 'TEXT'),  # 落库的发生记录对应的日期
+        ('completed_at', 'TEXT'),  # 完成时间，用于归档
+        ('parent_id', 'INTEGER'),  # 父任务
+        # 以下汇总值包含任务自身及所有子孙任务，由 task_closure 上的触发器增量维护
+        ('rollup_total_time', 'INTEGER DEFAULT 0'),
+        ('rollup_estimated_time', 'INTEGER DEFAULT 0'),
+        ('rollup_task_count', 'INTEGER DEFAULT 1'),
+        ('rollup_completed_count', 'INTEGER DEFAULT 0'),
+    ]
+
+    # 完成超过 ARCHIVE_AFTER_DAYS 天的任务移入 archive.db，每批最多 ARCHIVE_BATCH_SIZE 行
+    ARCHIVE_AFTER_DAYS = 30
+    ARCHIVE_BATCH_SIZE = 200
+    # 每批归档后增量回收的空闲页数
+    VACUUM_PAGES = 256
+
+    DEFAULT_PATH = 'todo.db'
+    # 数据库位置和内存模式也可以通过环境变量指定
+    PATH_ENV = 'TODO_DB'
+    MEMORY_ENV = 'TODO_DB_MEMORY'
+
+    def __init__(self, path=None, in_memory=None):
+        self.path = path or os.environ.get(self.PATH_ENV) or self.DEFAULT_PATH
+        if in_memory is None:
+            in_memory = os.environ.get(self.MEMORY_ENV, '') not in ('', '0')
+        self.in_memory = in_memory or self.path == ':memory:'
+        self.archive_path = archive_path_for(self.path)
+        self.backup_dir = backup_dir_for(self.path)
+
+        # 备份线程通过 backup API 读取同一个连接，因此关闭线程检查
+        if self.in_memory:
+            # 内存模式：启动时把文件载入 :memory:，之后定时和退出时写回
+            self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+            if self.path != ':memory:' and os.path.exists(self.path):
+                disk = sqlite3.connect(self.path)
+                try:
+                    disk.backup(self.conn)
+                finally:
+                    disk.close()
+        else:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.enable_incremental_vacuum()
+        # 归档数据很少访问，内存模式下仍然留在磁盘上
+        self.conn.execute('ATTACH DATABASE ? AS archive', (self.archive_path,))
         self.create_tables()
+        self.flushed_changes = self.conn.total_changes
+        # 标签位图索引在第一次按标签筛选时才构建
+        self._tag_index = None
+
+    def enable_incremental_vacuum(self):
+        # auto_vacuum 只能在建表前设置，已有数据库需要一次 VACUUM 才会生效
+        cursor = self.conn.cursor()
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != 2:
+            cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            cursor.execute('VACUUM')
 
     def create_tables(self):
         cursor = self.conn.cursor()
+        for schema in ('main', 'archive'):
+            self.create_tasks_table(schema)
+        # 每个重复任务的每个日期最多落库一次
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tasks (
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_occurrence
+            ON tasks (occurrence_date, recurrence_parent_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tasks_completed_at
+            ON tasks (completed, completed_at)
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tags (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_tags (
+                tag_id INTEGER NOT NULL,
+                task_id INTEGER NOT NULL,
+                PRIMARY KEY (tag_id, task_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_task_tags_task
+            ON task_tags (task_id, tag_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tasks_parent
+            ON tasks (parent_id)
+        ''')
+        self.create_hierarchy_triggers()
+        self.create_counter_triggers()
+        self.conn.commit()
+
+    # task_counters 中按维度计数的列，桶名为 "<列名>:<值>"
+    COUNTER_COLUMNS = ('priority', 'category', 'difficulty', 'timer_status')
+
+    def counter_buckets(self, row):
+        buckets = ["'all'", f"'completed:' || (COALESCE({row}.completed, 0) != 0)"]
+        buckets += [f"'{column}:' || COALESCE({row}.{column}, '')" for column in self.COUNTER_COLUMNS]
+        return buckets
+
+    def counter_statements(self, row, delta):
+        # 重复任务的模板行不在列表中显示，也不是某一天要完成的任务，不计入任何桶
+        values = ', '.join(f'({bucket}, {delta})' for bucket in self.counter_buckets(row))
+        return f'''
+                INSERT INTO task_counters (bucket, count)
+                SELECT column1, column2 FROM (VALUES {values}) WHERE {row}.recurrence IS NULL
+                ON CONFLICT (bucket) DO UPDATE SET count = count + excluded.count;
+                INSERT INTO task_counters (bucket, count)
+                SELECT 'open_due:' || {row}.due_date, {delta}
+                WHERE {row}.due_date IS NOT NULL AND COALESCE({row}.completed, 0) = 0
+                  AND {row}.recurrence IS NULL
+                ON CONFLICT (bucket) DO UPDATE SET count = count + excluded.count;'''
+
+    def create_trigger(self, name, body):
+        # 触发器定义变化时删除旧的重新创建；返回是否重建过，以便重新统计
+        sql = f'CREATE TRIGGER {name} {body}'
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name=?", (name,))
+        row = cursor.fetchone()
+        if row and row[0] == sql:
+            return False
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(sql)
+        return True
+
+    def create_counter_triggers(self):
+        # 每个筛选条件的任务数由触发器随增删改维护，读取时只需按主键查一行。
+        # open_due:<日期> 记录每个截止日期上未完成的任务数，逾期数是这些桶的范围求和
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_counters (
+                bucket TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        columns = ('completed', 'due_date', 'recurrence') + self.COUNTER_COLUMNS
+        watched = ', '.join(columns)
+        changed = ' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in columns)
+        # 旧版本创建的触发器统计口径不同，重建触发器后也要重新统计
+        rebuilt = [
+            self.create_trigger('tasks_counters_insert', f'''AFTER INSERT ON tasks
+            BEGIN{self.counter_statements('NEW', 1)}
+            END'''),
+            self.create_trigger('tasks_counters_update', f'''AFTER UPDATE OF {watched} ON tasks
+            WHEN {changed}
+            BEGIN{self.counter_statements('OLD', -1)}{self.counter_statements('NEW', 1)}
+            END'''),
+            self.create_trigger('tasks_counters_delete', f'''AFTER DELETE ON tasks
+            BEGIN{self.counter_statements('OLD', -1)}
+            END'''),
+        ]
+        if any(rebuilt):
+            self.rebuild_counters()
+
+    def rebuild_counters(self):
+        # 只在建表、触发器变化或恢复旧备份时全表统计一次
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM task_counters')
+        for bucket in self.counter_buckets('tasks'):
+            cursor.execute(f'''
+                INSERT INTO task_counters (bucket, count)
+                SELECT {bucket}, COUNT(*) FROM main.tasks WHERE recurrence IS NULL GROUP BY 1
+            ''')
+        cursor.execute('''
+            INSERT INTO task_counters (bucket, count)
+            SELECT 'open_due:' || due_date, COUNT(*) FROM main.tasks
+            WHERE due_date IS NOT NULL AND COALESCE(completed, 0) = 0 AND recurrence IS NULL
+            GROUP BY due_date
+        ''')
+        cursor.execute("INSERT INTO task_counters (bucket, count) SELECT 'archived', COUNT(*) FROM archive.tasks")
+
+    def create_hierarchy_triggers(self):
+        # 闭包表保存每个任务与其所有祖先（含自身，depth=0）的关系，
+        # 计时、预计时间或完成状态变化时只沿祖先链更新汇总值，不在显示时递归计算
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='task_closure'")
+        created = cursor.fetchone() is None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_closure (
+                ancestor_id INTEGER NOT NULL,
+                descendant_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                PRIMARY KEY (ancestor_id, descendant_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_task_closure_descendant
+            ON task_closure (descendant_id, depth)
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS tasks_hierarchy_insert AFTER INSERT ON tasks
+            BEGIN
+                INSERT INTO task_closure (ancestor_id, descendant_id, depth)
+                SELECT ancestor_id, NEW.id, depth + 1 FROM task_closure
+                WHERE descendant_id = NEW.parent_id
+                UNION ALL SELECT NEW.id, NEW.id, 0;
+                UPDATE tasks SET
+                    rollup_total_time = COALESCE(total_time, 0),
+                    rollup_estimated_time = COALESCE(estimated_time, 0),
+                    rollup_task_count = 1,
+                    rollup_completed_count = COALESCE(completed, 0) != 0
+                WHERE id = NEW.id;
+                UPDATE tasks SET
+                    rollup_total_time = rollup_total_time + COALESCE(NEW.total_time, 0),
+                    rollup_estimated_time = rollup_estimated_time + COALESCE(NEW.estimated_time, 0),
+                    rollup_task_count = rollup_task_count + 1,
+                    rollup_completed_count = rollup_completed_count + (COALESCE(NEW.completed, 0) != 0)
+                WHERE id IN (SELECT ancestor_id FROM task_closure WHERE descendant_id = NEW.id AND depth > 0);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS tasks_hierarchy_rollup
+            AFTER UPDATE OF total_time, estimated_time, completed ON tasks
+            WHEN OLD.total_time IS NOT NEW.total_time
+              OR OLD.estimated_time IS NOT NEW.estimated_time
+              OR (COALESCE(OLD.completed, 0) != 0) != (COALESCE(NEW.completed, 0) != 0)
+            BEGIN
+                UPDATE tasks SET
+                    rollup_total_time = rollup_total_time
+                        + COALESCE(NEW.total_time, 0) - COALESCE(OLD.total_time, 0),
+                    rollup_estimated_time = rollup_estimated_time
+                        + COALESCE(NEW.estimated_time, 0) - COALESCE(OLD.estimated_time, 0),
+                    rollup_completed_count = rollup_completed_count
+                        + (COALESCE(NEW.completed, 0) != 0) - (COALESCE(OLD.completed, 0) != 0)
+                WHERE id IN (SELECT ancestor_id FROM task_closure WHERE descendant_id = NEW.id);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS tasks_hierarchy_move
+            AFTER UPDATE OF parent_id ON tasks
+            WHEN OLD.parent_id IS NOT NEW.parent_id
+            BEGIN
+                UPDATE tasks SET
+                    rollup_total_time = rollup_total_time - NEW.rollup_total_time,
+                    rollup_estimated_time = rollup_estimated_time - NEW.rollup_estimated_time,
+                    rollup_task_count = rollup_task_count - NEW.rollup_task_count,
+                    rollup_completed_count = rollup_completed_count - NEW.rollup_completed_count
+                WHERE id IN (SELECT ancestor_id FROM task_closure WHERE descendant_id = NEW.id AND depth > 0);
+                DELETE FROM task_closure
+                WHERE descendant_id IN (SELECT descendant_id FROM task_closure WHERE ancestor_id = NEW.id)
+                  AND ancestor_id NOT IN (SELECT descendant_id FROM task_closure WHERE ancestor_id = NEW.id);
+                INSERT INTO task_closure (ancestor_id, descendant_id, depth)
+                SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+                FROM task_closure a, task_closure d
+                WHERE a.descendant_id = NEW.parent_id AND d.ancestor_id = NEW.id;
+                UPDATE tasks SET
+                    rollup_total_time = rollup_total_time + NEW.rollup_total_time,
+                    rollup_estimated_time = rollup_estimated_time + NEW.rollup_estimated_time,
+                    rollup_task_count = rollup_task_count + NEW.rollup_task_count,
+                    rollup_completed_count = rollup_completed_count + NEW.rollup_completed_count
+                WHERE id IN (SELECT ancestor_id FROM task_closure WHERE descendant_id = NEW.id AND depth > 0);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS tasks_hierarchy_delete AFTER DELETE ON tasks
+            BEGIN
+                UPDATE tasks SET
+                    rollup_total_time = rollup_total_time - COALESCE(OLD.total_time, 0),
+                    rollup_estimated_time = rollup_estimated_time - COALESCE(OLD.estimated_time, 0),
+                    rollup_task_count = rollup_task_count - 1,
+                    rollup_completed_count = rollup_completed_count - (COALESCE(OLD.completed, 0) != 0)
+                WHERE id IN (SELECT ancestor_id FROM task_closure WHERE descendant_id = OLD.id AND depth > 0);
+                DELETE FROM task_closure WHERE descendant_id = OLD.id;
+            END
+        ''')
+        if created:
+            self.rebuild_hierarchy()
+
+    def rebuild_hierarchy(self):
+        # 升级旧数据库或恢复旧备份时，按 parent_id 重建闭包表并重新计算所有汇总值
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM task_closure')
+        cursor.execute('''
+            WITH RECURSIVE closure (ancestor_id, descendant_id, depth) AS (
+                SELECT id, id, 0 FROM main.tasks
+                UNION ALL
+                SELECT closure.ancestor_id, tasks.id, closure.depth + 1
+                FROM closure JOIN main.tasks AS tasks ON tasks.parent_id = closure.descendant_id
+            )
+            INSERT INTO task_closure (ancestor_id, descendant_id, depth)
+            SELECT ancestor_id, descendant_id, depth FROM closure
+        ''')
+        cursor.execute('''
+            UPDATE main.tasks SET
+                (rollup_total_time, rollup_estimated_time, rollup_task_count, rollup_completed_count) = (
+                    SELECT SUM(COALESCE(d.total_time, 0)), SUM(COALESCE(d.estimated_time, 0)),
+                           COUNT(*), SUM(COALESCE(d.completed, 0) != 0)
+                    FROM task_closure JOIN main.tasks AS d ON d.id = task_closure.descendant_id
+                    WHERE task_closure.ancestor_id = tasks.id
+                )
+        ''')
+
+    def create_tasks_table(self, schema):
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.tasks (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 title TEXT NOT NULL,
                 description TEXT,
@@ -26,71 +343,247 @@ class Database:
                 timer_status TEXT DEFAULT 'stopped'  -- 计时器状态：running, paused, stopped
             )
         ''')
-        self.conn.commit()
+        added = self.migrate_columns(schema)
+        if 'completed_at' in added:
+            # 旧数据没有完成时间，用创建时间代替
+            cursor.execute(f'''
+                UPDATE {schema}.tasks SET completed_at=created_at
+                WHERE completed=1 AND completed_at IS NULL
+            ''')
+
+    def migrate_columns(self, schema):
+        cursor = self.conn.cursor()
+        cursor.execute(f'PRAGMA {schema}.table_info(tasks)')
+        existing = {row[1] for row in cursor.fetchall()}
+        added = []
+        for name, column_type in self.EXTRA_COLUMNS:
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {schema}.tasks ADD COLUMN {name} {column_type}')
+                added.append(name)
+        return added
 
-    def add_task(self, title, description, due_date, priority, category, difficulty):
+    def add_task(self, title, description, due_date, priority, category, difficulty, recurrence=None,
+                 parent_id=None):
+        # 归档任务没有闭包行，添加子任务前先把父任务移回热表
+        if parent_id is not None:
+            self.restore_archived_task(parent_id)
         cursor = self.conn.cursor()
         cursor.execute('''
             INSERT INTO tasks (
                 title, description, due_date, priority, category, difficulty, 
-                created_at, estimated_time, total_time, timer_status
+                created_at, estimated_time, total_time, timer_status, recurrence, parent_id
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0, 'stopped')
+            VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0, 'stopped', ?, ?)
         ''', (title, description, due_date, priority, category, difficulty, 
-              datetime.now().isoformat()))
+              datetime.now().isoformat(), recurrence, parent_id))
         self.conn.commit()
+        self.reindex_task(cursor.lastrowid)
         return cursor.lastrowid
 
-    def get_all_tasks(self, sort_by=None, reverse=False):
+    def order_clause(self, sort_by, reverse=False):
+        order_direction = 'DESC' if reverse else 'ASC'
+        if sort_by == 'due_date':
+            return f' ORDER BY CASE WHEN due_date IS NULL THEN 1 ELSE 0 END, due_date {order_direction}'
+        elif sort_by == 'priority':
+            priority_order = "CASE priority WHEN '高' THEN 1 WHEN '中' THEN 2 WHEN '低' THEN 3 ELSE 4 END"
+            return f' ORDER BY {priority_order} {order_direction}'
+        elif sort_by == 'difficulty':
+            difficulty_order = "CASE difficulty WHEN '困难' THEN 1 WHEN '中等' THEN 2 WHEN '简单' THEN 3 ELSE 4 END"
+            return f' ORDER BY {difficulty_order} {order_direction}'
+        elif sort_by == 'created_at':
+            return f' ORDER BY created_at {order_direction}'
+        return ''
+
+    def task_source(self, include_archive=False):
+        # 默认只读热表，历史视图才合并归档表
+        if include_archive:
+            return '(SELECT * FROM main.tasks UNION ALL SELECT * FROM archive.tasks)'
+        return 'main.tasks'
+
+    def get_all_tasks(self, sort_by=None, reverse=False, include_archive=False, roots_only=False):
         cursor = self.conn.cursor()
-        query = 'SELECT * FROM tasks'
-        
-        if sort_by:
-            order_direction = 'DESC' if reverse else 'ASC'
-            if sort_by == 'due_date':
-                query += f' ORDER BY CASE WHEN due_date IS NULL THEN 1 ELSE 0 END, due_date {order_direction}'
-            elif sort_by == 'priority':
-                priority_order = "CASE priority WHEN '高' THEN 1 WHEN '中' THEN 2 WHEN '低' THEN 3 ELSE 4 END"
-                query += f' ORDER BY {priority_order} {order_direction}'
-            elif sort_by == 'difficulty':
-                difficulty_order = "CASE difficulty WHEN '困难' THEN 1 WHEN '中等' THEN 2 WHEN '简单' THEN 3 ELSE 4 END"
-                query += f' ORDER BY {difficulty_order} {order_direction}'
-            elif sort_by == 'created_at':
-                query += f' ORDER BY created_at {order_direction}'
-        
-        cursor.execute(query)
+        query = f'SELECT * FROM {self.task_source(include_archive)}'
+        if roots_only:
+            query += ' WHERE parent_id IS NULL'
+        cursor.execute(query + self.order_clause(sort_by, reverse))
+        return cursor.fetchall()
+
+    def get_plannable_tasks(self):
+        # 自动排程只考虑未完成的叶子任务；父任务的工作量由子任务体现，重复任务按发生记录单独计时
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT * FROM main.tasks
+            WHERE completed=0 AND recurrence IS NULL AND rollup_task_count = 1
+        ''')
         return cursor.fetchall()
 
-    def update_task(self, task_id, title, description, due_date, priority, category, difficulty, completed):
+    def get_child_tasks(self, parent_id, sort_by=None, reverse=False):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM main.tasks WHERE parent_id=?' + self.order_clause(sort_by, reverse),
+                       (parent_id,))
+        return cursor.fetchall()
+
+    def set_task_parent(self, task_id, parent_id):
+        # 不能把任务移到自己或自己的子孙任务下面，也不能移到不存在的任务下面；
+        # 归档的父任务先移回热表
+        cursor = self.conn.cursor()
+        if parent_id is not None:
+            self.restore_archived_task(parent_id)
+            cursor.execute('SELECT 1 FROM main.tasks WHERE id=?', (parent_id,))
+            if cursor.fetchone() is None:
+                return False
+            cursor.execute('''
+                SELECT 1 FROM task_closure WHERE ancestor_id=? AND descendant_id=?
+            ''', (task_id, parent_id))
+            if cursor.fetchone():
+                return False
+        cursor.execute('UPDATE tasks SET parent_id=? WHERE id=?', (parent_id, task_id))
+        self.conn.commit()
+        return True
+
+    def get_task(self, task_id):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM main.tasks WHERE id=?', (task_id,))
+        task = cursor.fetchone()
+        if task is None:
+            cursor.execute('SELECT * FROM archive.tasks WHERE id=?', (task_id,))
+            task = cursor.fetchone()
+        return task
+
+    def update_task(self, task_id, title, description, due_date, priority, category, difficulty, completed,
+                    recurrence=None):
+        self.restore_archived_task(task_id)
         cursor = self.conn.cursor()
         cursor.execute('''
             UPDATE tasks 
             SET title=?, description=?, due_date=?, priority=?, category=?, 
-                difficulty=?, completed=?
+                difficulty=?, completed=?, recurrence=?,
+                completed_at=CASE WHEN ? THEN COALESCE(completed_at, ?) ELSE NULL END
             WHERE id=?
-        ''', (title, description, due_date, priority, category, difficulty, completed, task_id))
+        ''', (title, description, due_date, priority, category, difficulty, completed, recurrence,
+              completed, datetime.now().isoformat(), task_id))
         self.conn.commit()
+        self.reindex_task(task_id)
 
     def delete_task(self, task_id):
+        # 删除任务时一并删除所有子孙任务
         cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM tasks WHERE id=?', (task_id,))
+        cursor.execute('SELECT descendant_id FROM task_closure WHERE ancestor_id=?', (task_id,))
+        task_ids = [row[0] for row in cursor.fetchall()] or [task_id]
+        ids_json = json.dumps(task_ids)
+        cursor.execute('DELETE FROM main.tasks WHERE id IN (SELECT value FROM json_each(?))', (ids_json,))
+        cursor.execute('DELETE FROM archive.tasks WHERE id=?', (task_id,))
+        self.add_archived_count(-cursor.rowcount)
+        cursor.execute('''
+            SELECT DISTINCT tag_id FROM task_tags WHERE task_id IN (SELECT value FROM json_each(?))
+        ''', (ids_json,))
+        tag_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('DELETE FROM task_tags WHERE task_id IN (SELECT value FROM json_each(?))', (ids_json,))
         self.conn.commit()
+        if self._tag_index:
+            self._tag_index.remove_tasks(task_ids, tag_ids)
 
     def toggle_task_completion(self, task_id, completed):
+        self.restore_archived_task(task_id)
         cursor = self.conn.cursor()
-        cursor.execute('UPDATE tasks SET completed=? WHERE id=?', (completed, task_id))
+        cursor.execute('''
+            UPDATE tasks
+            SET completed=?, completed_at=CASE WHEN ? THEN COALESCE(completed_at, ?) ELSE NULL END
+            WHERE id=?
+        ''', (completed, completed, datetime.now().isoformat(), task_id))
         self.conn.commit()
+        self.reindex_task(task_id)
 
-    def get_tasks_by_filter(self, filter_type, value):
+    def get_tasks_by_filter(self, filter_type, value, sort_by='due_date', reverse=False):
         cursor = self.conn.cursor()
+        order = self.order_clause(sort_by, reverse)
         if filter_type == 'priority':
-            cursor.execute('SELECT * FROM tasks WHERE priority=? ORDER BY due_date', (value,))
+            cursor.execute('SELECT * FROM tasks WHERE priority=?' + order, (value,))
         elif filter_type == 'category':
-            cursor.execute('SELECT * FROM tasks WHERE category=? ORDER BY due_date', (value,))
+            cursor.execute('SELECT * FROM tasks WHERE category=?' + order, (value,))
         elif filter_type == 'completed':
-            cursor.execute('SELECT * FROM tasks WHERE completed=? ORDER BY due_date', (value,))
+            # 已完成的任务需要合并归档表
+            source = self.task_source(include_archive=bool(value))
+            cursor.execute(f'SELECT * FROM {source} WHERE completed=?' + order, (value,))
         return cursor.fetchall()
 
+    def archive_step(self, days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+        # 每次只移动一批，写锁只在这一小段事务内持有；返回移动的行数。
+        # 只归档没有父任务和子任务的任务，以免影响层级汇总
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id FROM main.tasks
+            WHERE completed=1 AND completed_at < ?
+              AND parent_id IS NULL AND rollup_task_count = 1
+            LIMIT ?
+        ''', (cutoff, batch_size))
+        task_ids = [row[0] for row in cursor.fetchall()]
+        if not task_ids:
+            return 0
+
+        placeholders = ','.join('?' * len(task_ids))
+        cursor.execute(f'INSERT INTO archive.tasks SELECT * FROM main.tasks WHERE id IN ({placeholders})',
+                       task_ids)
+        cursor.execute(f'DELETE FROM main.tasks WHERE id IN ({placeholders})', task_ids)
+        self.add_archived_count(len(task_ids))
+        self.conn.commit()
+        if self._tag_index:
+            self._tag_index.archive_tasks(task_ids)
+        cursor.execute(f'PRAGMA main.incremental_vacuum({self.VACUUM_PAGES})')
+        cursor.fetchall()
+        return len(task_ids)
+
+    def restore_archived_task(self, task_id):
+        # 修改已归档的任务前先移回热表
+        cursor = self.conn.cursor()
+        cursor.execute('INSERT OR IGNORE INTO main.tasks SELECT * FROM archive.tasks WHERE id=?', (task_id,))
+        if cursor.rowcount:
+            cursor.execute('DELETE FROM archive.tasks WHERE id=?', (task_id,))
+            self.add_archived_count(-1)
+            self.conn.commit()
+            self.reindex_task(task_id)
+
+    def materialize_occurrence(self, task_id, occurrence_date):
+        # 只有在完成或计时时才为重复任务的某个日期写入一行
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT OR IGNORE INTO tasks (
+                title, description, due_date, priority, category, difficulty,
+                created_at, estimated_time, total_time, timer_status,
+                recurrence_parent_id, occurrence_date
+            )
+            SELECT title, description, ?, priority, category, difficulty,
+                   ?, 0, 0, 'stopped', id, ?
+            FROM tasks WHERE id=?
+        ''', (occurrence_date, datetime.now().isoformat(), occurrence_date, task_id))
+        if cursor.rowcount:
+            # 发生记录继承重复任务的标签
+            cursor.execute('''
+                INSERT INTO task_tags (tag_id, task_id)
+                SELECT tag_id, ? FROM task_tags WHERE task_id=?
+            ''', (cursor.lastrowid, task_id))
+        self.conn.commit()
+        cursor.execute('''
+            SELECT id FROM tasks WHERE recurrence_parent_id=? AND occurrence_date=?
+        ''', (task_id, occurrence_date))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        self.reindex_task(row[0])
+        return row[0]
+
+    def get_materialized_occurrences(self, start_date, end_date):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT recurrence_parent_id, occurrence_date FROM tasks
+            WHERE occurrence_date BETWEEN ? AND ?
+        ''', (start_date, end_date))
+        materialized = {}
+        for parent_id, occurrence_date in cursor.fetchall():
+            materialized.setdefault(parent_id, set()).add(occurrence_date)
+        return materialized
+
     def start_timer(self, task_id, estimated_time):
         cursor = self.conn.cursor()
         current_time = datetime.now().isoformat()
@@ -157,10 +650,104 @@ class Database:
             cursor.execute('''
                 UPDATE tasks 
                 SET timer_status='stopped', timer_start_time=NULL, 
-                    timer_paused_time=NULL, total_time=?, completed=?
+                    timer_paused_time=NULL, total_time=?, completed=?,
+                    completed_at=CASE WHEN ? THEN COALESCE(completed_at, ?) ELSE NULL END
                 WHERE id=?
-            ''', (total_time, completed, task_id))
+            ''', (total_time, completed, completed, current_time, task_id))
             self.conn.commit()
+            self.reindex_task(task_id)
+
+    def get_tags(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT id, name FROM tags ORDER BY name')
+        return cursor.fetchall()
+
+    def get_task_tags(self, task_id):
+        return self.get_tags_for_tasks([task_id]).get(task_id, [])
+
+    def get_tags_for_tasks(self, task_ids):
+        # 一次查询取出当前显示的所有任务的标签
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT task_tags.task_id, tags.name FROM task_tags
+            JOIN tags ON tags.id = task_tags.tag_id
+            WHERE task_tags.task_id IN (SELECT value FROM json_each(?))
+            ORDER BY tags.name
+        ''', (json.dumps(list(task_ids)),))
+        task_tags = {}
+        for task_id, name in cursor.fetchall():
+            task_tags.setdefault(task_id, []).append(name)
+        return task_tags
+
+    def set_task_tags(self, task_id, names):
+        cursor = self.conn.cursor()
+        names = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+        cursor.execute('SELECT tag_id FROM task_tags WHERE task_id=?', (task_id,))
+        old_tag_ids = [row[0] for row in cursor.fetchall()]
+        cursor.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(name,) for name in names])
+        cursor.execute('DELETE FROM task_tags WHERE task_id=?', (task_id,))
+        cursor.execute('''
+            INSERT INTO task_tags (tag_id, task_id)
+            SELECT id, ? FROM tags WHERE name IN (SELECT value FROM json_each(?))
+        ''', (task_id, json.dumps(names)))
+        self.conn.commit()
+        self.reindex_task(task_id, old_tag_ids)
+
+    @property
+    def tag_index(self):
+        if self._tag_index is None:
+            self._tag_index = TagIndex.build(self.conn)
+        return self._tag_index
+
+    def reindex_task(self, task_id, old_tag_ids=()):
+        # 索引尚未构建时无需维护；old_tag_ids 是本次修改前任务的标签，其余标签的位图不受影响
+        if self._tag_index is None:
+            return
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT priority, completed, 0 FROM main.tasks WHERE id=?
+            UNION ALL SELECT priority, completed, 1 FROM archive.tasks WHERE id=?
+        ''', (task_id, task_id))
+        task = cursor.fetchone()
+        cursor.execute('SELECT tag_id FROM task_tags WHERE task_id=?', (task_id,))
+        tag_ids = [row[0] for row in cursor.fetchall()]
+        if task is None:
+            self._tag_index.clear_task(task_id, set(tag_ids) | set(old_tag_ids))
+            return
+        self._tag_index.set_task(task_id, task[0], task[1], tag_ids, old_tag_ids, bool(task[2]))
+
+    def query_tasks_by_tags(self, all_tags=(), any_tags=(), no_tags=(), priority=None, completed=None,
+                            sort_by=None, reverse=False, include_archive=False):
+        # 标签与优先级、完成状态的组合条件全部在位图上计算，只为命中的任务读取整行
+        bitmap = self.tag_index.query(all_tags, any_tags, no_tags, priority, completed, include_archive)
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f'SELECT * FROM {self.task_source(include_archive)} WHERE id IN (SELECT value FROM json_each(?))'
+            + self.order_clause(sort_by, reverse),
+            (json.dumps(list(iter_bits(bitmap))),))
+        return cursor.fetchall()
+
+    def add_archived_count(self, delta):
+        # 归档表不在 main 库中，不能建触发器，由移动数据的方法在同一事务中更新
+        if delta:
+            self.conn.execute('''
+                INSERT INTO task_counters (bucket, count) VALUES ('archived', ?)
+                ON CONFLICT (bucket) DO UPDATE SET count = count + excluded.count
+            ''', (delta,))
+
+    def get_counters(self):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT bucket, count FROM task_counters WHERE bucket NOT LIKE 'open_due:%'")
+        return dict(cursor.fetchall())
+
+    def get_overdue_count(self, today=None):
+        today = today or datetime.now().date().isoformat()
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT COALESCE(SUM(count), 0) FROM task_counters
+            WHERE bucket >= 'open_due:' AND bucket < 'open_due:' || ?
+        ''', (today,))
+        return cursor.fetchone()[0]
 
     def get_timer_status(self, task_id):
         cursor = self.conn.cursor()
@@ -170,5 +757,42 @@ class Database:
         ''', (task_id,))
         return cursor.fetchone()
 
+    def is_dirty(self):
+        return self.conn.total_changes != self.flushed_changes
+
+    def flush(self, progress=None, pages=BACKUP_PAGES_PER_STEP):
+        # 内存模式下把改动写回文件；backup API 在目标库上整体提交，不会留下一半的文件
+        if not self.in_memory or self.path == ':memory:' or not self.is_dirty():
+            return False
+        changes = self.conn.total_changes
+        backup_database(self.conn, self.path, pages=pages, progress=progress)
+        self.flushed_changes = changes
+        return True
+
+    def create_snapshot(self, progress=None):
+        return create_snapshot(self.conn, self.backup_dir, progress=progress)
+
+    def list_snapshots(self):
+        return list_snapshots(self.backup_dir)
+
+    def restore_snapshot(self, snapshot):
+        restore_snapshot(self.conn, snapshot, self.archive_path)
+        self._tag_index = None
+        # 旧版本的备份可能缺少新增的列、表和触发器
+        self.create_tables()
+        self.rebuild_hierarchy()
+        self.rebuild_counters()
+        self.conn.commit()
+        # backup API 不计入 total_changes，强制下次写回
+        self.flushed_changes = -1
+
+    def close(self):
+        if getattr(self, 'conn', None) is None:
+            return
+        # 退出时一次性写回
+        self.flush(pages=-1)
+        self.conn.close()
+        self.conn = None
+
     def __del__(self):
-        self.conn.close() 
\ No newline at end of file
+        self.close() 
\ No newline at end of file
@@ -1,10 +1,21 @@
+import argparse
 import sys
 from PyQt6.QtWidgets import QApplication
+from database import Database
 from todo_app import TodoApp
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="待办事项管理器")
+    parser.add_argument('--db', help="数据库文件路径（也可以用环境变量 TODO_DB 指定），:memory: 表示不落盘")
+    parser.add_argument('--memory', action='store_true', default=None,
+                        help="在内存中运行，定时和退出时写回数据库文件")
+    # 其余参数交给 Qt 处理
+    return parser.parse_known_args(argv)
+
 def main():
-    app = QApplication(sys.argv)
-    window = TodoApp()
+    args, qt_args = parse_args(sys.argv[1:])
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = TodoApp(Database(args.db, args.memory))
     window.show()
     sys.exit(app.exec())
 
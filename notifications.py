@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+# 稍后提醒的默认间隔（分钟）
+SNOOZE_MINUTES = 10
+
+
+class NotificationQueue:
+    # 计时器每秒只把提醒放进队列，界面在事件循环中取出显示。
+    # 每个任务同时最多有一条待处理或正在显示的提醒
+    def __init__(self):
+        self.pending = {}
+        self.shown = set()
+        self.snoozed = {}
+
+    def notify(self, task_id, title, now=None):
+        if task_id in self.pending or task_id in self.shown:
+            return False
+        now = now or datetime.now()
+        until = self.snoozed.get(task_id)
+        if until and now < until:
+            return False
+        self.snoozed.pop(task_id, None)
+        self.pending[task_id] = title
+        return True
+
+    def take_pending(self):
+        reminders = list(self.pending.items())
+        self.shown.update(self.pending)
+        self.pending.clear()
+        return reminders
+
+    def snooze(self, task_id, minutes=SNOOZE_MINUTES, now=None):
+        self.shown.discard(task_id)
+        self.snoozed[task_id] = (now or datetime.now()) + timedelta(minutes=minutes)
+
+    def reset(self, task_id):
+        self.pending.pop(task_id, None)
+        self.shown.discard(task_id)
+        self.snoozed.pop(task_id, None)
@@ -0,0 +1,161 @@
+import random
+import time
+from bisect import bisect_left
+from datetime import date, timedelta
+
+# 排序权重：同一截止日期内优先级高的先排
+PRIORITY_ORDER = {'高': 0, '中': 1, '低': 2}
+# 没有预计时间的任务按困难度估算（秒）
+DEFAULT_ESTIMATES = {'困难': 4 * 3600, '中等': 2 * 3600, '简单': 3600}
+# 已超出预计时间但仍未完成的任务至少再安排的时间（秒）
+MIN_REMAINING = 15 * 60
+HOURS_PER_DAY = 8
+WORKDAYS = (0, 1, 2, 3, 4)
+PLAN_DAYS = 90
+
+
+def remaining_seconds(task):
+    estimated = task[9] or DEFAULT_ESTIMATES.get(task[6], 3600)
+    return max(estimated - (task[10] or 0), MIN_REMAINING)
+
+
+def plan_key(task):
+    # 最早截止优先（EDF），没有截止日期的排在最后；其次按优先级，最后按 id 保证顺序稳定
+    return (task[3] or '9999-12-31', PRIORITY_ORDER.get(task[4], 3), task[0])
+
+
+class Planner:
+    # 按 plan_key 顺序把任务依次装入每天的工作时间。
+    # 每个位置记录装入后的进度，某个任务变化时只需从它的新旧位置中较早的一个开始重新装填
+    def __init__(self, start=None, days=PLAN_DAYS, hours_per_day=HOURS_PER_DAY, workdays=WORKDAYS):
+        self.start = start = start or date.today()
+        self.days = [start + timedelta(days=offset) for offset in range(days)
+                     if (start + timedelta(days=offset)).weekday() in workdays]
+        self.day_strings = [day.isoformat() for day in self.days]
+        self.capacity = int(hours_per_day * 3600)
+        self.keys = []
+        self.tasks = {}
+        # ends[i] 是装入第 i 个任务后的 (日期序号, 当天已用秒数)
+        self.ends = []
+        self.allocations = []
+        self.dirty_from = 0
+
+    def set_tasks(self, tasks):
+        self.tasks = {task[0]: (plan_key(task), remaining_seconds(task)) for task in tasks}
+        self.keys = sorted(key for key, _ in self.tasks.values())
+        self.ends = []
+        self.allocations = []
+        self.dirty_from = 0
+
+    def remove_task(self, task_id):
+        entry = self.tasks.pop(task_id, None)
+        if entry is None:
+            return
+        position = bisect_left(self.keys, entry[0])
+        del self.keys[position]
+        self.invalidate(position)
+
+    def update_task(self, task):
+        self.remove_task(task[0])
+        key = plan_key(task)
+        self.tasks[task[0]] = (key, remaining_seconds(task))
+        position = bisect_left(self.keys, key)
+        self.keys.insert(position, key)
+        self.invalidate(position)
+
+    def sync(self, tasks):
+        # 与数据库中的当前任务比较，只对新增、删除或排序键、剩余时间变化的任务做增量更新
+        current = {task[0]: task for task in tasks}
+        for task_id in [task_id for task_id in self.tasks if task_id not in current]:
+            self.remove_task(task_id)
+        for task_id, task in current.items():
+            if self.tasks.get(task_id) != (plan_key(task), remaining_seconds(task)):
+                self.update_task(task)
+
+    def invalidate(self, position):
+        self.dirty_from = min(self.dirty_from, position)
+        del self.ends[position:]
+        del self.allocations[position:]
+
+    def plan(self):
+        position = self.dirty_from
+        day_index, used = self.ends[position - 1] if position else (0, 0)
+
+        for key in self.keys[position:]:
+            remaining = self.tasks[key[2]][1]
+            allocation = []
+            while remaining > 0 and day_index < len(self.days):
+                chunk = min(remaining, self.capacity - used)
+                allocation.append((day_index, chunk))
+                remaining -= chunk
+                used += chunk
+                if used >= self.capacity:
+                    day_index += 1
+                    used = 0
+            self.allocations.append(allocation)
+            self.ends.append((day_index, used))
+        self.dirty_from = len(self.keys)
+
+    def schedule(self):
+        # 返回 [(日期, [(任务 id, 秒数), ...]), ...]，只包含有安排的日期
+        self.plan()
+        days = [[] for _ in self.days]
+        for key, allocation in zip(self.keys, self.allocations):
+            for day_index, chunk in allocation:
+                days[day_index].append((key[2], chunk))
+        return [(self.days[index], entries) for index, entries in enumerate(days) if entries]
+
+    def late_tasks(self):
+        # 完成日期晚于截止日期的任务
+        self.plan()
+        late = []
+        for key, allocation in zip(self.keys, self.allocations):
+            if allocation and key[0] != '9999-12-31' and self.day_strings[allocation[-1][0]] > key[0]:
+                late.append(key[2])
+        return late
+
+    def unscheduled_tasks(self):
+        # 计划范围内的工作时间不足以完成的任务
+        self.plan()
+        unscheduled = []
+        for key, allocation in zip(self.keys, self.allocations):
+            allocated = sum(chunk for _, chunk in allocation)
+            if allocated < self.tasks[key[2]][1]:
+                unscheduled.append(key[2])
+        return unscheduled
+
+
+def benchmark(task_count=10000, days=PLAN_DAYS):
+    # 用随机任务测量一个季度的完整规划和单个任务变化后的增量规划。
+    # 每天的工作时间按总工作量放大，使任务正好排满整个季度，而不是大部分落在计划范围之外
+    start = date.today()
+    tasks = []
+    for task_id in range(1, task_count + 1):
+        due = start + timedelta(days=random.randint(0, days)) if random.random() < 0.8 else None
+        tasks.append((task_id, f"任务{task_id}", '', due.isoformat() if due else None,
+                      random.choice('高中低'), '工作', random.choice(['困难', '中等', '简单']), 0, None,
+                      random.choice([0, 1800, 3600, 7200]), random.randint(0, 1800)))
+
+    workdays = len(Planner(start, days).days)
+    hours_per_day = sum(remaining_seconds(task) for task in tasks) * 1.05 / workdays / 3600
+    planner = Planner(start, days, hours_per_day)
+    began = time.perf_counter()
+    planner.set_tasks(tasks)
+    schedule = planner.schedule()
+    full = time.perf_counter() - began
+
+    changed = list(tasks[task_count // 2])
+    changed[3] = (start + timedelta(days=days // 2)).isoformat()
+    began = time.perf_counter()
+    planner.update_task(tuple(changed))
+    planner.schedule()
+    incremental = time.perf_counter() - began
+
+    print(f"{task_count} 个任务，{workdays} 个工作日，每天 {hours_per_day:.0f} 小时，安排到 {len(schedule)} 天")
+    print(f"完整规划: {full * 1000:.1f} ms")
+    print(f"增量规划: {incremental * 1000:.1f} ms")
+    print(f"逾期 {len(planner.late_tasks())} 个，未排入 {len(planner.unscheduled_tasks())} 个")
+
+
+if __name__ == '__main__':
+    benchmark()
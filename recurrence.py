@@ -0,0 +1,122 @@
+import calendar
+from datetime import date, timedelta
+
+# 重复规则以字符串形式保存在 tasks.recurrence 中：
+#   daily            每天
+#   weekly:0,2,4     每周的指定星期（0 为周一）
+#   monthly          每月同一天（月末自动取当月最后一天）
+#   every:N          每隔 N 天
+RECURRENCE_LABELS = {
+    'daily': "每天",
+    'weekly:0,1,2,3,4': "工作日",
+    'monthly': "每月",
+}
+
+WEEKDAY_NAMES = ["一", "二", "三", "四", "五", "六", "日"]
+
+# 列表中展开重复任务的默认窗口（天）
+DEFAULT_WINDOW_DAYS = 7
+
+
+def parse_rule(rule):
+    if not rule:
+        return None
+    kind, _, arg = rule.partition(':')
+    if kind in ('daily', 'monthly'):
+        return kind, None
+    if kind == 'weekly':
+        weekdays = sorted({int(d) for d in arg.split(',') if d.strip()})
+        if not weekdays or any(d < 0 or d > 6 for d in weekdays):
+            return None
+        return kind, weekdays
+    if kind == 'every':
+        try:
+            interval = int(arg)
+        except ValueError:
+            return None
+        return (kind, interval) if interval > 0 else None
+    return None
+
+
+def describe_rule(rule):
+    parsed = parse_rule(rule)
+    if not parsed:
+        return ""
+    if rule in RECURRENCE_LABELS:
+        return RECURRENCE_LABELS[rule]
+    kind, arg = parsed
+    if kind == 'weekly':
+        return "每周" + "、".join(WEEKDAY_NAMES[d] for d in arg)
+    if kind == 'every':
+        return f"每{arg}天"
+    return ""
+
+
+def _month_day(year, month, day):
+    return date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+
+# 惰性生成 [window_start, window_end] 内的发生日期，不遍历窗口之前的历史
+def iter_occurrences(rule, start, window_start, window_end):
+    parsed = parse_rule(rule)
+    if not parsed or window_end < start:
+        return
+    kind, arg = parsed
+    first = max(start, window_start)
+
+    if kind == 'daily' or kind == 'every':
+        interval = 1 if kind == 'daily' else arg
+        # 直接跳到窗口内的第一次发生
+        offset = -(-(first - start).days // interval) * interval
+        current = start + timedelta(days=offset)
+        while current <= window_end:
+            yield current
+            current += timedelta(days=interval)
+    elif kind == 'weekly':
+        current = first
+        while current <= window_end:
+            if current.weekday() in arg:
+                yield current
+            current += timedelta(days=1)
+    elif kind == 'monthly':
+        year, month = first.year, first.month
+        while True:
+            current = _month_day(year, month, start.day)
+            if current > window_end:
+                break
+            if current >= first:
+                yield current
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def occurrence_row(template, occurrence_date):
+    # 以模板行为基础构造一条未落库的发生记录，计时与完成状态清零，保留重复规则用于显示
+    row = list(template)
+    row[3] = occurrence_date.isoformat()
+    row[7] = 0
+    row[9] = 0
+    row[10] = 0
+    row[11] = None
+    row[12] = None
+    row[13] = 'stopped'
+    row[15] = template[0]
+    row[16] = occurrence_date.isoformat()
+    return tuple(row)
+
+
+# 把重复任务模板替换为窗口内的发生记录，已落库的发生日期会被跳过。
+# 生成 (task, occurrence_date) 二元组；普通任务的 occurrence_date 为 None
+def expand_tasks(tasks, materialized, window_start, window_end):
+    for task in tasks:
+        rule = task[14]
+        if not rule:
+            yield task, None
+            continue
+        try:
+            start = date.fromisoformat(task[3]) if task[3] else window_start
+        except ValueError:
+            start = window_start
+        done = materialized.get(task[0], ())
+        for occurrence in iter_occurrences(rule, start, window_start, window_end):
+            if occurrence.isoformat() not in done:
+                yield occurrence_row(task, occurrence), occurrence.isoformat()
@@ -0,0 +1,126 @@
+from collections import defaultdict
+
+# 内存中的位图索引：每个标签、优先级以及完成状态各对应一个整数位图，第 n 位表示 id 为 n 的任务。
+# Python 整数的按位运算在 C 中逐字进行，百万级任务的多标签交并差只需要毫秒级时间。
+
+
+def bitmap_from_ids(task_ids):
+    task_ids = list(task_ids)
+    if not task_ids:
+        return 0
+    # 先在 bytearray 中置位再一次性转换，避免逐位构造大整数
+    bits = bytearray((max(task_ids) >> 3) + 1)
+    for task_id in task_ids:
+        bits[task_id >> 3] |= 1 << (task_id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def iter_bits(bitmap):
+    binary = bin(bitmap)[:1:-1]
+    position = binary.find('1')
+    while position >= 0:
+        yield position
+        position = binary.find('1', position + 1)
+
+
+class TagIndex:
+    def __init__(self):
+        self.tags = {}
+        self.priorities = {}
+        self.completed = 0
+        self.live = 0
+        self.archived = 0
+
+    @classmethod
+    def build(cls, conn):
+        index = cls()
+        cursor = conn.cursor()
+
+        # 归档任务单独记在 archived 位图中，只有“已完成”和“历史记录”筛选会包含它们
+        live, archived, completed = [], [], []
+        priorities = defaultdict(list)
+        cursor.execute('''
+            SELECT id, priority, completed, 0 FROM main.tasks
+            UNION ALL SELECT id, priority, completed, 1 FROM archive.tasks
+        ''')
+        for task_id, priority, is_completed, is_archived in cursor:
+            (archived if is_archived else live).append(task_id)
+            priorities[priority].append(task_id)
+            if is_completed:
+                completed.append(task_id)
+        index.live = bitmap_from_ids(live)
+        index.archived = bitmap_from_ids(archived)
+        index.completed = bitmap_from_ids(completed)
+        index.priorities = {priority: bitmap_from_ids(ids) for priority, ids in priorities.items()}
+
+        tags = defaultdict(list)
+        cursor.execute('SELECT tag_id, task_id FROM task_tags')
+        for tag_id, task_id in cursor:
+            tags[tag_id].append(task_id)
+        index.tags = {tag_id: bitmap_from_ids(ids) for tag_id, ids in tags.items()}
+        return index
+
+    def clear_task(self, task_id, tag_ids=None):
+        # 单个任务只清除它所在的位图，不构造与最大 id 等宽的掩码去遍历所有位图。
+        # 调用方知道任务原有的标签时只需检查这些标签的位图
+        bit = 1 << task_id
+        if self.live >> task_id & 1:
+            self.live ^= bit
+        if self.archived >> task_id & 1:
+            self.archived ^= bit
+        if self.completed >> task_id & 1:
+            self.completed ^= bit
+        for key, bitmap in self.priorities.items():
+            if bitmap >> task_id & 1:
+                self.priorities[key] = bitmap ^ bit
+        for tag_id in self.tags if tag_ids is None else tag_ids:
+            bitmap = self.tags.get(tag_id, 0)
+            if bitmap >> task_id & 1:
+                self.tags[tag_id] = bitmap ^ bit
+
+    def archive_tasks(self, task_ids):
+        # 移入归档库的任务保留标签和优先级，只从热表位图转到归档位图
+        bitmap = bitmap_from_ids(task_ids)
+        self.live &= ~bitmap
+        self.archived |= bitmap
+
+    def remove_tasks(self, task_ids, tag_ids=None):
+        mask = ~bitmap_from_ids(task_ids)
+        self.live &= mask
+        self.archived &= mask
+        self.completed &= mask
+        for key in self.priorities:
+            self.priorities[key] &= mask
+        for tag_id in self.tags if tag_ids is None else tag_ids:
+            if tag_id in self.tags:
+                self.tags[tag_id] &= mask
+
+    def set_task(self, task_id, priority, completed, tag_ids, old_tag_ids=(), archived=False):
+        self.clear_task(task_id, set(tag_ids) | set(old_tag_ids))
+        bit = 1 << task_id
+        if archived:
+            self.archived |= bit
+        else:
+            self.live |= bit
+        if completed:
+            self.completed |= bit
+        self.priorities[priority] = self.priorities.get(priority, 0) | bit
+        for tag_id in tag_ids:
+            self.tags[tag_id] = self.tags.get(tag_id, 0) | bit
+
+    def query(self, all_tags=(), any_tags=(), no_tags=(), priority=None, completed=None, include_archive=False):
+        result = self.live | self.archived if include_archive else self.live
+        for tag_id in all_tags:
+            result &= self.tags.get(tag_id, 0)
+        if any_tags:
+            union = 0
+            for tag_id in any_tags:
+                union |= self.tags.get(tag_id, 0)
+            result &= union
+        for tag_id in no_tags:
+            result &= ~self.tags.get(tag_id, 0)
+        if priority is not None:
+            result &= self.priorities.get(priority, 0)
+        if completed is not None:
+            result &= self.completed if completed else ~self.completed
+        return result
@@ -0,0 +1,133 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from database import Database
+
+# 最初版本的表结构，用于验证旧数据库升级
+BASELINE_SCHEMA = '''
+    CREATE TABLE tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT,
+        due_date TEXT,
+        priority TEXT,
+        category TEXT,
+        difficulty TEXT,
+        completed BOOLEAN DEFAULT 0,
+        created_at TEXT,
+        estimated_time INTEGER,
+        total_time INTEGER DEFAULT 0,
+        timer_start_time TEXT,
+        timer_paused_time TEXT,
+        timer_status TEXT DEFAULT 'stopped'
+    )
+'''
+
+
+class UpgradeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'todo.db')
+        conn = sqlite3.connect(self.path)
+        conn.execute(BASELINE_SCHEMA)
+        conn.execute('''
+            INSERT INTO tasks (title, priority, completed, created_at, estimated_time, total_time)
+            VALUES ('旧任务', '高', 0, '2024-01-01T00:00:00', 600, 100)
+        ''')
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.directory)
+
+    def rollups(self, task_id):
+        cursor = self.db.conn.cursor()
+        cursor.execute('''
+            SELECT rollup_total_time, rollup_estimated_time, rollup_task_count, rollup_completed_count
+            FROM tasks WHERE id=?
+        ''', (task_id,))
+        return cursor.fetchone()
+
+    def test_existing_tasks_get_closure_rows(self):
+        self.db = Database(self.path)
+        cursor = self.db.conn.cursor()
+        cursor.execute('SELECT ancestor_id, descendant_id, depth FROM task_closure')
+        self.assertEqual(cursor.fetchall(), [(1, 1, 0)])
+        self.assertEqual(self.rollups(1), (100, 600, 1, 0))
+
+    def test_subtask_of_existing_task_rolls_up(self):
+        self.db = Database(self.path)
+        child = self.db.add_task('子任务', '', None, '中', '工作', '简单', parent_id=1)
+        self.db.update_total_time(child, 50)
+        self.db.toggle_task_completion(child, True)
+        self.assertEqual(self.rollups(1), (150, 600, 2, 1))
+        self.assertEqual([task[0] for task in self.db.get_child_tasks(1)], [child])
+
+
+class ArchivedParentTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:')
+        self.parent = self.db.add_task('父任务', '', None, '高', '工作', '困难')
+        self.db.update_total_time(self.parent, 100)
+        self.db.toggle_task_completion(self.parent, True)
+        self.db.conn.execute("UPDATE tasks SET completed_at='2000-01-01T00:00:00'")
+        self.db.conn.commit()
+        self.assertEqual(self.db.archive_step(), 1)
+
+    def tearDown(self):
+        self.db.close()
+
+    def rollups(self, task_id):
+        cursor = self.db.conn.cursor()
+        cursor.execute('''
+            SELECT rollup_total_time, rollup_task_count FROM main.tasks WHERE id=?
+        ''', (task_id,))
+        return cursor.fetchone()
+
+    def test_add_subtask_restores_archived_parent(self):
+        child = self.db.add_task('子任务', '', None, '中', '工作', '简单', parent_id=self.parent)
+        self.db.update_total_time(child, 50)
+        self.assertEqual(self.rollups(self.parent), (150, 2))
+        self.assertEqual(self.db.get_counters()['archived'], 0)
+
+    def test_move_under_archived_parent_restores_it(self):
+        task = self.db.add_task('任务', '', None, '中', '工作', '简单')
+        self.db.update_total_time(task, 30)
+        self.assertTrue(self.db.set_task_parent(task, self.parent))
+        self.assertEqual(self.rollups(self.parent), (130, 2))
+
+    def test_move_under_missing_parent_is_rejected(self):
+        task = self.db.add_task('任务', '', None, '中', '工作', '简单')
+        self.assertFalse(self.db.set_task_parent(task, 999))
+        self.assertIsNone(self.db.get_task(task)[18])
+
+
+class CounterTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:')
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_recurring_template_is_not_counted(self):
+        template = self.db.add_task('每天', '', '2024-01-01', '高', '生活', '简单', 'daily')
+        self.assertEqual(self.db.get_overdue_count('2024-01-11'), 0)
+        self.assertEqual(self.db.get_counters().get('all', 0), 0)
+
+        occurrence = self.db.materialize_occurrence(template, '2024-01-05')
+        self.assertEqual(self.db.get_overdue_count('2024-01-11'), 1)
+        self.db.toggle_task_completion(occurrence, True)
+        self.assertEqual(self.db.get_overdue_count('2024-01-11'), 0)
+
+        # 取消重复后按普通任务计数
+        self.db.update_task(template, '每天', '', '2024-01-01', '高', '生活', '简单', 0, None)
+        self.assertEqual(self.db.get_overdue_count('2024-01-11'), 1)
+        self.assertEqual(self.db.get_counters()['all'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,25 @@
-from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
+from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QPushButton, QLineEdit, QTextEdit, QLabel, QComboBox,
                              QDateEdit, QListWidget, QListWidgetItem, QMessageBox,
-                             QDialog, QFormLayout, QMenu, QFrame, QSpinBox)
-from PyQt6.QtCore import Qt, QDate, QTimer, QDateTime
-from PyQt6.QtGui import QFont, QColor, QPalette
+                             QDialog, QFormLayout, QMenu, QFrame, QSpinBox, QInputDialog,
+                             QTreeWidget, QTreeWidgetItem)
+from PyQt6.QtCore import Qt, QDate, QTimer, QDateTime, QThread, pyqtSignal
+from PyQt6.QtGui import QFont, QColor, QPalette, QActionGroup
 from database import Database
-from datetime import datetime, timedelta
+from notifications import SNOOZE_MINUTES, NotificationQueue
+from planner import HOURS_PER_DAY, Planner
+from datetime import date, datetime, timedelta
+from recurrence import DEFAULT_WINDOW_DAYS, describe_rule, expand_tasks, parse_rule
+
+def format_seconds(seconds):
+    seconds = int(seconds or 0)
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
 
 class TaskDialog(QDialog):
-    def __init__(self, parent=None, task_data=None):
+    def __init__(self, parent=None, task_data=None, tags=None):
         super().__init__(parent)
         self.task_data = task_data
+        self.tags = tags or []
         self.setup_ui()
         self.setStyleSheet("""
             QDialog {
@@ -75,12 +84,31 @@ class TaskDialog(QDialog):
         self.category_combo = QComboBox()
         self.category_combo.addItems(["工作", "学习", "生活", "其他"])
 
+        # 重复规则：以截止日期为第一次发生的日期
+        recurrence_layout = QHBoxLayout()
+        self.recurrence_combo = QComboBox()
+        self.recurrence_combo.addItems(["不重复", "每天", "工作日", "每周", "每月", "每隔N天"])
+        self.interval_spin = QSpinBox()
+        self.interval_spin.setRange(2, 365)
+        self.interval_spin.setSuffix(" 天")
+        self.interval_spin.setEnabled(False)
+        self.recurrence_combo.currentTextChanged.connect(
+            lambda text: self.interval_spin.setEnabled(text == "每隔N天"))
+        recurrence_layout.addWidget(self.recurrence_combo, 1)
+        recurrence_layout.addWidget(self.interval_spin)
+
+        self.tags_edit = QLineEdit()
+        self.tags_edit.setPlaceholderText("多个标签用逗号分隔（可选）")
+        self.tags_edit.setText("，".join(self.tags))
+
         layout.addRow("标题:", self.title_edit)
         layout.addRow("描述:", self.description_edit)
         layout.addRow("截止日期:", self.due_date_edit)
         layout.addRow("优先级:", self.priority_combo)
         layout.addRow("困难度:", self.difficulty_combo)
         layout.addRow("分类:", self.category_combo)
+        layout.addRow("重复:", recurrence_layout)
+        layout.addRow("标签:", self.tags_edit)
 
         buttons = QHBoxLayout()
         save_btn = QPushButton("保存")
@@ -99,9 +127,41 @@ class TaskDialog(QDialog):
             self.priority_combo.setCurrentText(self.task_data[4])
             self.category_combo.setCurrentText(self.task_data[5])
             self.difficulty_combo.setCurrentText(self.task_data[6])
+            self.set_recurrence(self.task_data[14])
 
         self.setLayout(layout)
 
+    def set_recurrence(self, rule):
+        parsed = parse_rule(rule)
+        if not parsed:
+            return
+        kind, arg = parsed
+        if rule == 'daily':
+            self.recurrence_combo.setCurrentText("每天")
+        elif rule == 'weekly:0,1,2,3,4':
+            self.recurrence_combo.setCurrentText("工作日")
+        elif kind == 'weekly':
+            self.recurrence_combo.setCurrentText("每周")
+        elif kind == 'monthly':
+            self.recurrence_combo.setCurrentText("每月")
+        elif kind == 'every':
+            self.recurrence_combo.setCurrentText("每隔N天")
+            self.interval_spin.setValue(arg)
+
+    def get_recurrence(self):
+        text = self.recurrence_combo.currentText()
+        if text == "每天":
+            return 'daily'
+        elif text == "工作日":
+            return 'weekly:0,1,2,3,4'
+        elif text == "每周":
+            return f'weekly:{self.due_date_edit.date().dayOfWeek() - 1}'
+        elif text == "每月":
+            return 'monthly'
+        elif text == "每隔N天":
+            return f'every:{self.interval_spin.value()}'
+        return None
+
     def get_task_data(self):
         return {
             'title': self.title_edit.text(),
@@ -109,7 +169,9 @@ class TaskDialog(QDialog):
             'due_date': self.due_date_edit.date().toString("yyyy-MM-dd"),
             'priority': self.priority_combo.currentText(),
             'category': self.category_combo.currentText(),
-            'difficulty': self.difficulty_combo.currentText()
+            'difficulty': self.difficulty_combo.currentText(),
+            'recurrence': self.get_recurrence(),
+            'tags': [tag.strip() for tag in self.tags_edit.text().replace("，", ",").split(",") if tag.strip()]
         }
 
 class TimerDialog(QDialog):
@@ -177,20 +239,42 @@ class TimerDialog(QDialog):
         return self.hours_spin.value() * 60 + self.minutes_spin.value()
 
 class TaskItem(QFrame):
-    def __init__(self, task_data, parent=None):
+    def __init__(self, task_data, parent=None, tags=None, depth=0, expanded=False):
         super().__init__(parent)
         self.task_data = task_data
+        self.tags = tags or []
+        # depth 为 None 表示平铺显示，不提供展开子任务的按钮
+        self.depth = depth
+        self.expanded = expanded
         self.setup_ui()
         self.update_timer_display()
 
+    def has_subtasks(self):
+        return (self.task_data[21] or 1) > 1  # rollup_task_count 包含自身
+
     def setup_ui(self):
         layout = QVBoxLayout(self)
-        layout.setContentsMargins(20, 15, 20, 15)
+        layout.setContentsMargins(20 + (self.depth or 0) * 30, 15, 20, 15)
         layout.setSpacing(10)
         
         # 创建标题行
         title_layout = QHBoxLayout()
         title_layout.setSpacing(10)
+        self.expand_button = QPushButton()
+        self.expand_button.setStyleSheet("""
+            QPushButton {
+                padding: 2px 6px;
+                background-color: transparent;
+                color: #2196F3;
+                border: none;
+                font-size: 12px;
+            }
+        """)
+        self.set_expanded(self.expanded)
+        if self.depth is not None and self.has_subtasks():
+            title_layout.addWidget(self.expand_button)
+        else:
+            self.expand_button.hide()
         title_label = QLabel(self.task_data[1])
         title_label.setFont(QFont("Arial", 12, QFont.Weight.Bold))
         title_label.setWordWrap(True)
@@ -228,8 +312,30 @@ class TaskItem(QFrame):
         
         details_layout.addWidget(category_label)
         details_layout.addWidget(difficulty_label)
+        if self.task_data[14]:  # 重复任务的发生记录
+            recurrence_label = QLabel(f"重复: {describe_rule(self.task_data[14])}")
+            recurrence_label.setStyleSheet("color: #2196F3; font-size: 12px;")
+            details_layout.addWidget(recurrence_label)
+        for tag in self.tags:
+            tag_label = QLabel(f"#{tag}")
+            tag_label.setStyleSheet("color: #1976D2; background-color: #e3f2fd; border-radius: 4px; "
+                                    "padding: 2px 6px; font-size: 12px;")
+            details_layout.addWidget(tag_label)
         details_layout.addStretch()
         details_layout.addWidget(due_date_label)
+
+        # 子任务汇总行，数值由数据库触发器沿祖先链维护
+        rollup_layout = QHBoxLayout()
+        if self.has_subtasks():
+            task_count = self.task_data[21]
+            completed_count = self.task_data[22] or 0
+            rollup_label = QLabel(
+                f"子任务完成: {completed_count}/{task_count} ({completed_count * 100 // task_count}%)"
+                f"  合计用时: {format_seconds(self.task_data[19])}"
+                f" / 预计: {format_seconds(self.task_data[20])}")
+            rollup_label.setStyleSheet("color: #666; font-size: 12px;")
+            rollup_layout.addWidget(rollup_label)
+            rollup_layout.addStretch()
         
         # 创建计时器行
         timer_layout = QHBoxLayout()
@@ -296,6 +402,7 @@ class TaskItem(QFrame):
         
         layout.addLayout(title_layout)
         layout.addLayout(details_layout)
+        layout.addLayout(rollup_layout)
         layout.addLayout(timer_layout)
         
         self.setStyleSheet("""
@@ -313,6 +420,10 @@ class TaskItem(QFrame):
             }
         """)
 
+    def set_expanded(self, expanded):
+        self.expanded = expanded
+        self.expand_button.setText("▼" if expanded else "▶")
+
     def update_timer_display(self):
         timer_status = self.task_data[13]  # timer_status
         total_time = self.task_data[10]    # total_time (以秒为单位)
@@ -373,10 +484,158 @@ class TaskItem(QFrame):
             else:
                 self.timer_time_label.setText("")
 
+class ReminderToast(QFrame):
+    # 非模态的提醒浮窗，不阻塞计时器和其他任务的刷新
+    def __init__(self, task_id, title, parent=None):
+        super().__init__(parent, Qt.WindowType.Tool | Qt.WindowType.FramelessWindowHint |
+                         Qt.WindowType.WindowStaysOnTopHint)
+        self.task_id = task_id
+        self.setAttribute(Qt.WidgetAttribute.WA_ShowWithoutActivating)
+        self.setup_ui(title)
+
+    def setup_ui(self, title):
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(15, 12, 15, 12)
+        layout.setSpacing(8)
+
+        title_label = QLabel(f"预计时间已到：{title}")
+        title_label.setFont(QFont("Arial", 11, QFont.Weight.Bold))
+        title_label.setWordWrap(True)
+        message_label = QLabel("任务是否已完成？")
+
+        buttons = QHBoxLayout()
+        self.complete_button = QPushButton("已完成")
+        self.pause_button = QPushButton("暂停计时")
+        self.snooze_button = QPushButton(f"{SNOOZE_MINUTES}分钟后提醒")
+        buttons.addWidget(self.complete_button)
+        buttons.addWidget(self.pause_button)
+        buttons.addWidget(self.snooze_button)
+
+        layout.addWidget(title_label)
+        layout.addWidget(message_label)
+        layout.addLayout(buttons)
+        self.setFixedWidth(340)
+
+        self.setStyleSheet("""
+            ReminderToast {
+                background-color: white;
+                border: 1px solid #2196F3;
+                border-radius: 8px;
+            }
+            QLabel {
+                color: #333;
+                font-size: 12px;
+            }
+            QPushButton {
+                padding: 6px 10px;
+                background-color: #2196F3;
+                color: white;
+                border: none;
+                border-radius: 4px;
+                font-size: 12px;
+            }
+            QPushButton:hover {
+                background-color: #1976D2;
+            }
+        """)
+
+class BackupThread(QThread):
+    progress = pyqtSignal(str, int, int)
+    succeeded = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, job, parent=None):
+        super().__init__(parent)
+        self.job = job
+
+    def run(self):
+        # 分步复制，每步只短暂占用连接，界面线程不会被阻塞
+        try:
+            result = self.job(lambda name, remaining, total: self.progress.emit(name, remaining, total))
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.succeeded.emit(str(result))
+
+class PlanDialog(QDialog):
+    # 非模态的日程视图，任务列表变化时由主窗口刷新
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.planner = None
+        self.setup_ui()
+
+    def setup_ui(self):
+        self.setWindowTitle("日程安排")
+        self.setMinimumSize(500, 500)
+        layout = QVBoxLayout(self)
+
+        options = QHBoxLayout()
+        options.addWidget(QLabel("每天工作时间:"))
+        self.hours_spin = QSpinBox()
+        self.hours_spin.setRange(1, 24)
+        self.hours_spin.setValue(HOURS_PER_DAY)
+        self.hours_spin.setSuffix(" 小时")
+        self.hours_spin.valueChanged.connect(self.reset_planner)
+        options.addWidget(self.hours_spin)
+        options.addStretch()
+        layout.addLayout(options)
+
+        self.plan_tree = QTreeWidget()
+        self.plan_tree.setHeaderLabels(["日期 / 任务", "时间"])
+        self.plan_tree.setColumnWidth(0, 340)
+        layout.addWidget(self.plan_tree)
+
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+
+    def reset_planner(self):
+        self.planner = None
+        self.refresh()
+
+    def refresh(self):
+        tasks = self.db.get_plannable_tasks()
+        # 跨天后从今天重新规划，否则只增量更新变化的任务
+        if self.planner is None or self.planner.start != date.today():
+            self.planner = Planner(hours_per_day=self.hours_spin.value())
+            self.planner.set_tasks(tasks)
+        else:
+            self.planner.sync(tasks)
+        titles = {task[0]: task[1] for task in tasks}
+        late = set(self.planner.late_tasks())
+        unscheduled = self.planner.unscheduled_tasks()
+
+        self.plan_tree.clear()
+        for day, entries in self.planner.schedule():
+            used = sum(seconds for _, seconds in entries)
+            day_item = QTreeWidgetItem([day.strftime("%Y-%m-%d %a"),
+                                        f"{format_seconds(used)} / {format_seconds(self.planner.capacity)}"])
+            for task_id, seconds in entries:
+                task_item = QTreeWidgetItem([titles.get(task_id, ''), format_seconds(seconds)])
+                if task_id in late:
+                    task_item.setForeground(0, QColor("#f44336"))
+                day_item.addChild(task_item)
+            self.plan_tree.addTopLevelItem(day_item)
+        if unscheduled:
+            overflow = QTreeWidgetItem(["无法排入", str(len(unscheduled))])
+            for task_id in unscheduled:
+                overflow.addChild(QTreeWidgetItem([titles.get(task_id, '')]))
+            self.plan_tree.addTopLevelItem(overflow)
+        if self.plan_tree.topLevelItemCount():
+            self.plan_tree.topLevelItem(0).setExpanded(True)
+
+        self.summary_label.setText(f"共 {len(tasks)} 个任务，逾期 {len(late)} 个，无法排入 {len(unscheduled)} 个")
+
 class TodoApp(QMainWindow):
-    def __init__(self):
+    def __init__(self, db=None):
         super().__init__()
-        self.db = Database()
+        self.db = db or Database()
+        # 已展开子任务的任务 id
+        self.expanded_tasks = set()
+        # 计时提醒队列和当前显示的提醒浮窗
+        self.notifications = NotificationQueue()
+        self.reminder_toasts = {}
+        self.plan_dialog = None
         self.setup_ui()
         self.load_tasks()
         
@@ -385,6 +644,26 @@ class TodoApp(QMainWindow):
         self.update_timer.timeout.connect(self.update_timers)
         self.update_timer.start(1000)  # 每秒更新一次
 
+        # 后台分批归档已完成的旧任务，每批之间把事件循环让给界面
+        self.archive_timer = QTimer()
+        self.archive_timer.timeout.connect(self.run_archive)
+        self.archive_timer.start(60 * 60 * 1000)  # 每小时检查一次
+        self.archived_count = 0
+        QTimer.singleShot(5000, self.run_archive)
+
+        # 定时在后台线程中生成快照
+        self.backup_thread = None
+        self.backup_timer = QTimer()
+        self.backup_timer.timeout.connect(self.start_backup)
+        self.backup_timer.start(6 * 60 * 60 * 1000)  # 每6小时备份一次
+
+        # 内存模式下定时把改动写回磁盘
+        self.flush_thread = None
+        self.flush_timer = QTimer()
+        self.flush_timer.timeout.connect(self.start_flush)
+        if self.db.in_memory:
+            self.flush_timer.start(30 * 1000)  # 每30秒检查一次
+
         self.setStyleSheet("""
             QMainWindow {
                 background-color: #f5f9ff;
@@ -440,16 +719,26 @@ class TodoApp(QMainWindow):
         # 创建工具栏
         toolbar = QHBoxLayout()
         self.add_btn = QPushButton("添加任务")
-        self.add_btn.clicked.connect(self.add_task)
+        self.add_btn.clicked.connect(lambda: self.add_task())
         toolbar.addWidget(self.add_btn)
 
         # 添加筛选选项
         self.filter_combo = QComboBox()
-        self.filter_combo.addItems(["全部", "未完成", "已完成", "高优先级", "中优先级", "低优先级"])
-        self.filter_combo.currentTextChanged.connect(self.apply_filter)
+        # 显示文字会带上任务数，筛选逻辑使用条目数据中的名称
+        for filter_name in ["全部", "未完成", "已完成", "高优先级", "中优先级", "低优先级", "历史记录"]:
+            self.filter_combo.addItem(filter_name, filter_name)
+        self.filter_combo.currentIndexChanged.connect(self.apply_filter)
         toolbar.addWidget(QLabel("筛选:"))
         toolbar.addWidget(self.filter_combo)
 
+        # 标签多选筛选：包含的标签按“全部匹配”或“任一匹配”组合，排除的标签总是取反
+        self.tag_filter = {'include': set(), 'exclude': set(), 'match_all': True}
+        self.tag_filter_btn = QPushButton("标签")
+        self.tag_filter_menu = QMenu(self)
+        self.tag_filter_menu.aboutToShow.connect(self.build_tag_filter_menu)
+        self.tag_filter_btn.setMenu(self.tag_filter_menu)
+        toolbar.addWidget(self.tag_filter_btn)
+
         # 添加排序选项
         self.sort_combo = QComboBox()
         self.sort_combo.addItems(["截止日期", "优先级", "困难度", "创建时间"])
@@ -465,6 +754,19 @@ class TodoApp(QMainWindow):
         toolbar.addWidget(self.sort_direction_combo)
 
         toolbar.addStretch()
+
+        # 自动排程
+        self.plan_btn = QPushButton("日程")
+        self.plan_btn.clicked.connect(self.show_plan)
+        toolbar.addWidget(self.plan_btn)
+
+        # 备份与恢复
+        self.backup_btn = QPushButton("备份")
+        self.backup_btn.clicked.connect(self.start_backup)
+        toolbar.addWidget(self.backup_btn)
+        self.restore_btn = QPushButton("恢复")
+        self.restore_btn.clicked.connect(self.restore_backup)
+        toolbar.addWidget(self.restore_btn)
         layout.addLayout(toolbar)
 
         # 创建任务列表
@@ -475,13 +777,194 @@ class TodoApp(QMainWindow):
         self.task_list.setSpacing(5)
         layout.addWidget(self.task_list)
 
+        # 状态栏右侧常驻显示任务统计
+        self.counter_label = QLabel()
+        self.statusBar().addPermanentWidget(self.counter_label)
+
     def load_tasks(self):
         self.task_list.clear()
         sort_by = self.get_sort_by()
         reverse = self.sort_direction_combo.currentText() == "降序"
-        tasks = self.db.get_all_tasks(sort_by, reverse)
-        for task in tasks:
-            self.add_task_to_list(task)
+        tasks = self.fetch_tasks(self.filter_combo.currentData(), sort_by, reverse)
+        self.add_task_rows(tasks, 0 if self.is_hierarchical() else None)
+        self.update_counters()
+        if self.plan_dialog and self.plan_dialog.isVisible():
+            self.plan_dialog.refresh()
+
+    def show_plan(self):
+        if self.plan_dialog is None:
+            self.plan_dialog = PlanDialog(self.db, self)
+        self.plan_dialog.refresh()
+        self.plan_dialog.show()
+        self.plan_dialog.raise_()
+
+    def update_counters(self):
+        # 计数由数据库触发器维护，这里只读取几行，每次刷新列表时都可以更新
+        counters = self.db.get_counters()
+        total = counters.get('all', 0)
+        archived = counters.get('archived', 0)
+        open_count = counters.get('completed:0', 0)
+        counts = {
+            "全部": total,
+            "未完成": open_count,
+            "已完成": counters.get('completed:1', 0) + archived,
+            "高优先级": counters.get('priority:高', 0),
+            "中优先级": counters.get('priority:中', 0),
+            "低优先级": counters.get('priority:低', 0),
+            "历史记录": total + archived,
+        }
+        for index in range(self.filter_combo.count()):
+            filter_name = self.filter_combo.itemData(index)
+            self.filter_combo.setItemText(index, f"{filter_name} ({counts[filter_name]})")
+
+        self.counter_label.setText(
+            f"共 {total} 项  未完成 {open_count}  计时中 {counters.get('timer_status:running', 0)}"
+            f"  逾期 {self.db.get_overdue_count()}  已归档 {archived}")
+
+    def is_hierarchical(self):
+        # 只有“全部”视图按层级显示，其余筛选结果平铺显示
+        return (self.filter_combo.currentData() == "全部"
+                and not self.tag_filter['include'] and not self.tag_filter['exclude'])
+
+    def add_task_rows(self, tasks, depth, position=None):
+        sort_by = self.get_sort_by()
+        reverse = self.sort_direction_combo.currentText() == "降序"
+
+        # 重复任务只在可见的日期窗口内展开，已落库的日期由数据库中的行显示
+        window_start = date.today()
+        window_end = window_start + timedelta(days=DEFAULT_WINDOW_DAYS)
+        materialized = self.db.get_materialized_occurrences(
+            window_start.isoformat(), window_end.isoformat())
+        rows = list(expand_tasks(tasks, materialized, window_start, window_end))
+        if sort_by == 'due_date':
+            rows.sort(key=lambda row: row[0][3] or '', reverse=reverse)
+            rows.sort(key=lambda row: row[0][3] is None)
+
+        task_tags = self.db.get_tags_for_tasks({task[0] for task, _ in rows})
+        for task, occurrence_date in rows:
+            position = self.add_task_to_list(task, occurrence_date, task_tags.get(task[0]), depth, position)
+            # 子任务按需加载，只展开用户展开过的节点
+            if depth is not None and occurrence_date is None and task[0] in self.expanded_tasks:
+                position = self.add_task_rows(
+                    self.db.get_child_tasks(task[0], sort_by, reverse), depth + 1, position)
+        return position
+
+    def toggle_subtasks(self, task_id):
+        for row in range(self.task_list.count()):
+            item = self.task_list.item(row)
+            if item.data(Qt.ItemDataRole.UserRole) == task_id and item.data(Qt.ItemDataRole.UserRole + 1) is None:
+                break
+        else:
+            return
+
+        # 只插入或移除该节点下方的行，不重建整个列表
+        depth = item.data(Qt.ItemDataRole.UserRole + 2)
+        if task_id in self.expanded_tasks:
+            self.expanded_tasks.discard(task_id)
+            while row + 1 < self.task_list.count() and \
+                    self.task_list.item(row + 1).data(Qt.ItemDataRole.UserRole + 2) > depth:
+                self.task_list.takeItem(row + 1)
+        else:
+            self.expanded_tasks.add(task_id)
+            self.add_task_rows(self.db.get_child_tasks(task_id, self.get_sort_by(),
+                                                       self.sort_direction_combo.currentText() == "降序"),
+                               depth + 1, row + 1)
+        self.task_list.itemWidget(item).set_expanded(task_id in self.expanded_tasks)
+
+    def fetch_tasks(self, filter_text, sort_by, reverse):
+        if self.tag_filter['include'] or self.tag_filter['exclude']:
+            return self.fetch_tasks_by_tags(filter_text, sort_by, reverse)
+        if filter_text == "未完成":
+            return self.db.get_tasks_by_filter('completed', False, sort_by, reverse)
+        elif filter_text == "已完成":
+            return self.db.get_tasks_by_filter('completed', True, sort_by, reverse)
+        elif filter_text == "高优先级":
+            return self.db.get_tasks_by_filter('priority', "高", sort_by, reverse)
+        elif filter_text == "中优先级":
+            return self.db.get_tasks_by_filter('priority', "中", sort_by, reverse)
+        elif filter_text == "低优先级":
+            return self.db.get_tasks_by_filter('priority', "低", sort_by, reverse)
+        elif filter_text == "历史记录":
+            return self.db.get_all_tasks(sort_by, reverse, include_archive=True)
+        return self.db.get_all_tasks(sort_by, reverse, roots_only=True)
+
+    def fetch_tasks_by_tags(self, filter_text, sort_by, reverse):
+        # 筛选条件全部交给位图索引；与不按标签筛选时一致，“已完成”和“历史记录”包含归档任务
+        priority = {"高优先级": "高", "中优先级": "中", "低优先级": "低"}.get(filter_text)
+        completed = {"未完成": False, "已完成": True}.get(filter_text)
+        include = self.tag_filter['include']
+        return self.db.query_tasks_by_tags(
+            all_tags=include if self.tag_filter['match_all'] else (),
+            any_tags=include if not self.tag_filter['match_all'] else (),
+            no_tags=self.tag_filter['exclude'],
+            priority=priority,
+            completed=completed,
+            sort_by=sort_by,
+            reverse=reverse,
+            include_archive=filter_text in ("已完成", "历史记录"))
+
+    def build_tag_filter_menu(self):
+        menu = self.tag_filter_menu
+        menu.clear()
+        tags = self.db.get_tags()
+        if not tags:
+            menu.addAction("暂无标签").setEnabled(False)
+            return
+
+        mode_group = QActionGroup(menu)
+        for text, match_all in (("全部匹配", True), ("任一匹配", False)):
+            action = menu.addAction(text)
+            action.setCheckable(True)
+            action.setChecked(self.tag_filter['match_all'] == match_all)
+            action.triggered.connect(lambda checked, m=match_all: self.set_tag_filter_mode(m))
+            mode_group.addAction(action)
+        menu.addSeparator()
+
+        exclude_menu = QMenu("排除", menu)
+        for tag_id, name in tags:
+            for target, key in ((menu, 'include'), (exclude_menu, 'exclude')):
+                action = target.addAction(name)
+                action.setCheckable(True)
+                action.setChecked(tag_id in self.tag_filter[key])
+                action.toggled.connect(
+                    lambda checked, t=tag_id, k=key: self.toggle_tag_filter(k, t, checked))
+        menu.addSeparator()
+        menu.addMenu(exclude_menu)
+        menu.addAction("清除标签筛选").triggered.connect(self.clear_tag_filter)
+
+    def set_tag_filter_mode(self, match_all):
+        self.tag_filter['match_all'] = match_all
+        self.load_tasks()
+
+    def toggle_tag_filter(self, key, tag_id, checked):
+        if checked:
+            self.tag_filter[key].add(tag_id)
+        else:
+            self.tag_filter[key].discard(tag_id)
+        self.update_tag_filter_button()
+        self.load_tasks()
+
+    def clear_tag_filter(self):
+        self.tag_filter['include'].clear()
+        self.tag_filter['exclude'].clear()
+        self.update_tag_filter_button()
+        self.load_tasks()
+
+    def update_tag_filter_button(self):
+        count = len(self.tag_filter['include']) + len(self.tag_filter['exclude'])
+        self.tag_filter_btn.setText(f"标签 ({count})" if count else "标签")
+
+    def run_archive(self):
+        moved = self.db.archive_step()
+        self.archived_count += moved
+        if moved == Database.ARCHIVE_BATCH_SIZE:
+            # 还有剩余，稍后继续下一批
+            QTimer.singleShot(50, self.run_archive)
+        elif self.archived_count:
+            self.archived_count = 0
+            # 内存模式下归档库的插入已经在磁盘上，尽快在后台写回热表的删除，缩短两库重复的窗口
+            self.start_flush()
+            self.load_tasks()
 
     def get_sort_by(self):
         sort_text = self.sort_combo.currentText()
@@ -496,37 +979,54 @@ class TodoApp(QMainWindow):
     def apply_sort(self):
         self.load_tasks()
 
-    def add_task_to_list(self, task):
+    def add_task_to_list(self, task, occurrence_date=None, tags=None, depth=None, position=None):
         item = QListWidgetItem()
-        task_widget = TaskItem(task)
-        task_widget.timer_button.clicked.connect(lambda: self.handle_timer_click(task[0]))
+        expanded = occurrence_date is None and task[0] in self.expanded_tasks
+        task_widget = TaskItem(task, tags=tags, depth=depth, expanded=expanded)
+        task_widget.timer_button.clicked.connect(
+            lambda: self.handle_timer_click(task[0], occurrence_date))
         task_widget.stop_button.clicked.connect(lambda: self.stop_timer(task[0]))
+        task_widget.expand_button.clicked.connect(lambda: self.toggle_subtasks(task[0]))
         item.setSizeHint(task_widget.sizeHint())
+        # 未落库的重复任务发生记录保存模板 id 和发生日期
         item.setData(Qt.ItemDataRole.UserRole, task[0])
-        self.task_list.addItem(item)
+        item.setData(Qt.ItemDataRole.UserRole + 1, occurrence_date)
+        item.setData(Qt.ItemDataRole.UserRole + 2, depth or 0)
+        if position is None:
+            self.task_list.addItem(item)
+        else:
+            self.task_list.insertItem(position, item)
+            position += 1
         self.task_list.setItemWidget(item, task_widget)
+        return position
 
-    def add_task(self):
+    def add_task(self, parent_id=None):
         dialog = TaskDialog(self)
         if dialog.exec():
             task_data = dialog.get_task_data()
-            self.db.add_task(
+            task_id = self.db.add_task(
                 task_data['title'],
                 task_data['description'],
                 task_data['due_date'],
                 task_data['priority'],
                 task_data['category'],
-                task_data['difficulty']
+                task_data['difficulty'],
+                task_data['recurrence'],
+                parent_id
             )
+            if parent_id:
+                self.expanded_tasks.add(parent_id)
+            if task_data['tags']:
+                self.db.set_task_tags(task_id, task_data['tags'])
             self.load_tasks()
 
     def edit_task(self, item):
+        # 双击重复任务的发生记录时编辑整个重复任务
         task_id = item.data(Qt.ItemDataRole.UserRole)
-        tasks = self.db.get_all_tasks()
-        task_data = next((t for t in tasks if t[0] == task_id), None)
+        task_data = self.db.get_task(task_id)
         
         if task_data:
-            dialog = TaskDialog(self, task_data)
+            dialog = TaskDialog(self, task_data, self.db.get_task_tags(task_id))
             if dialog.exec():
                 new_data = dialog.get_task_data()
                 self.db.update_task(
@@ -537,41 +1037,35 @@ class TodoApp(QMainWindow):
                     new_data['priority'],
                     new_data['category'],
                     new_data['difficulty'],
-                    task_data[7]
+                    task_data[7],
+                    new_data['recurrence']
                 )
+                self.db.set_task_tags(task_id, new_data['tags'])
                 self.load_tasks()
 
-    def apply_filter(self, filter_text):
-        self.task_list.clear()
-        if filter_text == "全部":
-            tasks = self.db.get_all_tasks()
-        elif filter_text == "未完成":
-            tasks = self.db.get_tasks_by_filter('completed', False)
-        elif filter_text == "已完成":
-            tasks = self.db.get_tasks_by_filter('completed', True)
-        elif filter_text == "高优先级":
-            tasks = self.db.get_tasks_by_filter('priority', "高")
-        elif filter_text == "中优先级":
-            tasks = self.db.get_tasks_by_filter('priority', "中")
-        elif filter_text == "低优先级":
-            tasks = self.db.get_tasks_by_filter('priority', "低")
-
-        for task in tasks:
-            self.add_task_to_list(task)
+    def apply_filter(self, index):
+        self.load_tasks()
 
     def show_context_menu(self, position):
         item = self.task_list.itemAt(position)
         if item:
             task_id = item.data(Qt.ItemDataRole.UserRole)
+            occurrence_date = item.data(Qt.ItemDataRole.UserRole + 1)
             menu = QMenu()
             
-            tasks = self.db.get_all_tasks()
-            task = next((t for t in tasks if t[0] == task_id), None)
+            task = self.db.get_task(task_id)
             if task:
+                if occurrence_date:
+                    # 未落库的发生记录：完成状态总是未完成，删除作用于整个重复任务
+                    task = task[:7] + (0,) + task[8:13] + ('stopped',) + task[14:]
                 # 根据当前状态显示不同的菜单文本
                 toggle_text = "标记为未完成" if task[7] else "标记为已完成"
                 toggle_action = menu.addAction(toggle_text)
                 delete_action = menu.addAction("删除")
+
+                # 子任务相关菜单项，未落库的重复发生记录不能作为父任务
+                subtask_action = None if occurrence_date else menu.addAction("添加子任务")
+                detach_action = menu.addAction("移为顶层任务") if task[18] and not occurrence_date else None
                 
                 # 添加计时器相关菜单项
                 timer_status = task[13]  # timer_status
@@ -580,16 +1074,29 @@ class TodoApp(QMainWindow):
                 
                 action = menu.exec(self.task_list.mapToGlobal(position))
                 if action == delete_action:
+                    if occurrence_date:
+                        message = '确定要删除这个重复任务吗？'
+                    elif (task[21] or 1) > 1:
+                        message = '确定要删除这个任务及其所有子任务吗？'
+                    else:
+                        message = '确定要删除这个任务吗？'
                     reply = QMessageBox.question(self, '确认删除', 
-                                               '确定要删除这个任务吗？',
+                                               message,
                                                QMessageBox.StandardButton.Yes | 
                                                QMessageBox.StandardButton.No)
                     if reply == QMessageBox.StandardButton.Yes:
                         self.db.delete_task(task_id)
                         self.load_tasks()
                 elif action == toggle_action:
+                    if occurrence_date:
+                        task_id = self.db.materialize_occurrence(task_id, occurrence_date)
                     self.db.toggle_task_completion(task_id, not task[7])
                     self.load_tasks()
+                elif action and action == subtask_action:
+                    self.add_task(parent_id=task_id)
+                elif action and action == detach_action:
+                    self.db.set_task_parent(task_id, None)
+                    self.load_tasks()
                 elif action and action.text() == "结束计时":
                     self.stop_timer(task_id)
 
@@ -599,6 +1106,7 @@ class TodoApp(QMainWindow):
                                    QMessageBox.StandardButton.Yes | 
                                    QMessageBox.StandardButton.No)
         completed = reply == QMessageBox.StandardButton.Yes
+        self.clear_reminder(task_id)
         self.db.stop_timer(task_id, completed)
         self.load_tasks()
 
@@ -619,21 +1127,78 @@ class TodoApp(QMainWindow):
                             total_time = timer_status[3] if timer_status[3] else 0
                             total_elapsed = current_elapsed + total_time
                             if total_elapsed >= timer_status[1]:  # 已经是秒为单位
-                                self.check_task_completion(task_id)
+                                # 只放入队列，不在计时回调中弹出模态对话框
+                                self.notifications.notify(task_id, task_widget.task_data[1])
                         except (ValueError, TypeError, AttributeError):
                             # 如果时间格式无效，跳过检查
                             pass
+        self.show_reminders()
+
+    def show_reminders(self):
+        for task_id, title in self.notifications.take_pending():
+            toast = ReminderToast(task_id, title, self)
+            toast.complete_button.clicked.connect(lambda checked, t=task_id: self.complete_from_reminder(t))
+            toast.pause_button.clicked.connect(lambda checked, t=task_id: self.pause_from_reminder(t))
+            toast.snooze_button.clicked.connect(lambda checked, t=task_id: self.snooze_reminder(t))
+            self.reminder_toasts[task_id] = toast
+            toast.show()
+            QApplication.alert(self)
+        self.position_reminders()
+
+    def position_reminders(self):
+        # 提醒浮窗从主窗口右下角向上堆叠
+        geometry = self.geometry()
+        bottom = geometry.bottom() - 20
+        for toast in self.reminder_toasts.values():
+            toast.adjustSize()
+            bottom -= toast.height()
+            toast.move(geometry.right() - toast.width() - 20, bottom)
+            bottom -= 10
+
+    def close_reminder(self, task_id):
+        toast = self.reminder_toasts.pop(task_id, None)
+        if toast:
+            toast.close()
+            toast.deleteLater()
+            self.position_reminders()
+
+    def clear_reminder(self, task_id):
+        self.notifications.reset(task_id)
+        self.close_reminder(task_id)
+
+    def complete_from_reminder(self, task_id):
+        self.clear_reminder(task_id)
+        self.db.stop_timer(task_id, True)
+        self.load_tasks()
 
-    def handle_timer_click(self, task_id):
+    def pause_from_reminder(self, task_id):
+        timer_status = self.db.get_timer_status(task_id)
+        if timer_status and timer_status[0] == 'running':
+            self.handle_timer_click(task_id)
+        else:
+            self.clear_reminder(task_id)
+
+    def snooze_reminder(self, task_id):
+        self.notifications.snooze(task_id)
+        self.close_reminder(task_id)
+
+    def handle_timer_click(self, task_id, occurrence_date=None):
         timer_status = self.db.get_timer_status(task_id)
         if not timer_status:
             return
+        # 计时状态改变后重新开始提醒
+        self.clear_reminder(task_id)
             
         status = timer_status[0]
+        if occurrence_date:
+            # 重复任务的发生记录总是从未计时开始
+            status = 'stopped'
         if status == 'stopped':
             dialog = TimerDialog(self)
             if dialog.exec():
                 estimated_time = dialog.get_time_minutes()
+                if occurrence_date:
+                    task_id = self.db.materialize_occurrence(task_id, occurrence_date)
                 self.db.start_timer(task_id, estimated_time)
                 self.load_tasks()
         elif status == 'running':
@@ -657,14 +1222,62 @@ class TodoApp(QMainWindow):
             self.db.resume_timer(task_id)
             self.load_tasks()
 
-    def check_task_completion(self, task_id):
-        reply = QMessageBox.question(self, '任务时间提醒', 
-                                   '预计时间已到，任务是否已完成？',
-                                   QMessageBox.StandardButton.Yes | 
+    def start_backup(self):
+        if self.backup_thread and self.backup_thread.isRunning():
+            return
+        self.backup_btn.setEnabled(False)
+        self.restore_btn.setEnabled(False)
+        self.backup_thread = BackupThread(self.db.create_snapshot, self)
+        self.backup_thread.progress.connect(self.show_backup_progress)
+        self.backup_thread.succeeded.connect(self.backup_finished)
+        self.backup_thread.failed.connect(self.backup_failed)
+        self.backup_thread.start()
+
+    def show_backup_progress(self, name, remaining, total):
+        if total:
+            percent = (total - remaining) * 100 // total
+            self.statusBar().showMessage(f"正在备份 {name}: {percent}%")
+
+    def backup_finished(self, snapshot):
+        self.backup_btn.setEnabled(True)
+        self.restore_btn.setEnabled(True)
+        self.statusBar().showMessage(f"备份完成: {snapshot}", 5000)
+
+    def backup_failed(self, error):
+        self.backup_btn.setEnabled(True)
+        self.restore_btn.setEnabled(True)
+        self.statusBar().clearMessage()
+        QMessageBox.warning(self, '备份失败', error)
+
+    def restore_backup(self):
+        snapshots = self.db.list_snapshots()
+        if not snapshots:
+            QMessageBox.information(self, '恢复', '没有可用的备份')
+            return
+        snapshot, ok = QInputDialog.getItem(self, '恢复', '选择要恢复的备份:', snapshots, 0, False)
+        if not ok:
+            return
+        reply = QMessageBox.question(self, '确认恢复',
+                                   '恢复后当前数据将被备份内容替换，确定继续吗？',
+                                   QMessageBox.StandardButton.Yes |
                                    QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
-            self.db.toggle_task_completion(task_id, True)
-            self.stop_timer(task_id)
-        else:
-            self.db.pause_timer(task_id)
-            self.load_tasks() 
\ No newline at end of file
+            self.db.restore_snapshot(snapshot)
+            if self.plan_dialog:
+                self.plan_dialog.planner = None
+            self.load_tasks()
+
+    def start_flush(self):
+        if not self.db.is_dirty() or (self.flush_thread and self.flush_thread.isRunning()):
+            return
+        self.flush_thread = BackupThread(self.db.flush, self)
+        self.flush_thread.failed.connect(lambda error: self.statusBar().showMessage(f"保存失败: {error}", 5000))
+        self.flush_thread.start()
+
+    def closeEvent(self, event):
+        # 等待后台复制结束，再把内存中的改动写回磁盘
+        for thread in (self.backup_thread, self.flush_thread):
+            if thread:
+                thread.wait()
+        self.db.close()
+        super().closeEvent(event)